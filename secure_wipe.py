@@ -1,134 +1,439 @@
 #!/usr/bin/env python3
 import argparse
+import ctypes
+import hmac
 import os
-import subprocess
+import platform
+import struct
+import sys
 import json
-from datetime import datetime
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-import secrets
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import hashlib
+import mmap
+from datetime import datetime, timezone
+
+try:
+    import fcntl  # NVMe/SG_IO passthrough ioctls, not available on Windows
+except ImportError:
+    fcntl = None
 
 # Certificate output directory
 CERT_DIR = "certificates"
 os.makedirs(CERT_DIR, exist_ok=True)
 
-CHUNK_SIZE = 64 * 1024  # 64 KB chunks for file shredding
+# 4 MiB chunks for file shredding: large enough that the per-call overhead
+# into OpenSSL is negligible. The mmap path encrypts in place and needs no
+# buffers, except one chunk-sized bytes object for the tail of each region.
+# The streaming fallback (Windows, empty files, unmappable files) holds a
+# plaintext and a ciphertext buffer, so its peak RSS is about 2 * CHUNK_SIZE
+# and only that path clamps the chunk size to free memory.
+CHUNK_SIZE = 4 * 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+# Files at least this large are shredded by several threads at once.
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+
+# Linux NVMe admin passthrough (linux/nvme_ioctl.h). struct nvme_passthru_cmd:
+# opcode, flags, rsvd1, nsid, cdw2, cdw3, metadata, addr, metadata_len,
+# data_len, cdw10..cdw15, timeout_ms, result -- 72 bytes.
+NVME_PASSTHRU_CMD = struct.Struct("=BBHIIIQQII6III")
+NVME_IOCTL_ID = 0x4E40  # _IO('N', 0x40)
+NVME_IOCTL_ADMIN_CMD = 0xC0484E41  # _IOWR('N', 0x41, struct nvme_passthru_cmd)
+NVME_ADMIN_IDENTIFY = 0x06
+NVME_ADMIN_FORMAT_NVM = 0x80
+NVME_FORMAT_TIMEOUT_MS = 600 * 1000
+
+# SCSI generic ioctl (scsi/sg.h) carrying ATA PASS-THROUGH(16) commands, the
+# same path hdparm uses. struct sg_io_hdr: interface_id, dxfer_direction,
+# cmd_len, mx_sb_len, iovec_count, dxfer_len, dxferp, cmdp, sbp, timeout,
+# flags, pack_id, usr_ptr, status, masked_status, msg_status, sb_len_wr,
+# host_status, driver_status, resid, duration, info (88 bytes on 64-bit).
+SG_IO_HDR = struct.Struct("@iiBBHIPPPIIiPBBBBHHiII0P")
+SG_IO = 0x2285
+SG_DXFER_NONE = -1
+SG_DXFER_TO_DEV = -2
+ATA_16 = 0x85
+ATA_PROTO_NON_DATA = 3
+ATA_PROTO_PIO_DATA_OUT = 5
+ATA_SECURITY_SET_PASSWORD = 0xF1
+ATA_SECURITY_ERASE_PREPARE = 0xF3
+ATA_SECURITY_ERASE_UNIT = 0xF4
+ATA_SECURITY_PASSWORD = b"p"  # temporary user password, cleared by the erase
+ATA_TIMEOUT_MS = 60 * 1000
+ATA_ERASE_TIMEOUT_MS = 12 * 3600 * 1000
+
+# Clamp the requested chunk size so both shred_stream buffers fit comfortably
+# in free RAM.
+def effective_chunk_size(requested):
+    try:
+        page = os.sysconf("SC_PAGESIZE")
+        free = page * os.sysconf("SC_AVPHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return max(requested, MIN_CHUNK_SIZE)
+    limit = free // 8  # 2 buffers, keep them within a quarter of free memory
+    limit -= limit % page
+    return max(min(requested, limit), MIN_CHUNK_SIZE)
+
+# Page-cache hints for the shred streams; a no-op where posix_fadvise is missing.
+def fadvise(f, *advice):
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for name in advice:
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, getattr(os, name))
+        except OSError:
+            pass
+
+def certificate_text(c, y):
+    text = c.beginText(100, y)
+    text.setFont("Helvetica", 12)
+    text.setLeading(20)
+    return text
+
+# Callers read the clock once and pass the same instant here, so the
+# certificate file name and its "timestamp" field always agree.
+def generate_certificate(metadata, prefix, now):
+    # ReportLab and orjson (like cryptography and concurrent.futures in the
+    # shred helpers) are imported lazily so --help and other early exits
+    # start without them.
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    try:
+        import orjson  # optional, faster JSON certificates
+    except ImportError:
+        orjson = None
 
-def generate_certificate(metadata, prefix):
-    ts = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    ts = now.strftime("%Y%m%d%H%M%S")
     base = f"{prefix}_{ts}"
     json_path = os.path.join(CERT_DIR, f"{base}.json")
     pdf_path = os.path.join(CERT_DIR, f"{base}.pdf")
 
-    with open(json_path, "w") as f:
-        json.dump(metadata, f, indent=4)
+    # Both writers produce the same bytes: UTF-8, non-ASCII left unescaped,
+    # 2-space indent (the only indent orjson supports).
+    if orjson is not None:
+        with open(json_path, "wb") as f:
+            f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    else:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
 
     c = canvas.Canvas(pdf_path, pagesize=letter)
     c.setFont("Helvetica-Bold", 14)
     c.drawString(100, 750, "SecureErase Certificate")
-    c.setFont("Helvetica", 12)
-    y = 730
+    # One text object per page: a single BT/ET block in the content stream
+    # instead of a positioned drawString per field.
+    text = certificate_text(c, 730)
     for k, v in metadata.items():
-        c.drawString(100, y, f"{k}: {v}")
-        y -= 20
-        if y < 50:
+        if text.getY() < 50:
+            c.drawText(text)
             c.showPage()
-            y = 750
+            text = certificate_text(c, 750)
+        text.textLine(f"{k}: {v}")
+    c.drawText(text)
     c.showPage()
     c.save()
 
     print(f"[+] Certificate generated: {json_path}, {pdf_path}")
 
-def full_disk_erase(device, is_nvme, dry_run):
+def nvme_admin_cmd(fd, opcode, nsid, cdw10=0, data=None, timeout_ms=0):
+    addr = ctypes.addressof(data) if data is not None else 0
+    data_len = ctypes.sizeof(data) if data is not None else 0
+    cmd = bytearray(NVME_PASSTHRU_CMD.pack(
+        opcode, 0, 0, nsid, 0, 0, 0, addr, 0, data_len,
+        cdw10, 0, 0, 0, 0, 0, timeout_ms, 0))
+    status = fcntl.ioctl(fd, NVME_IOCTL_ADMIN_CMD, cmd)
+    if status != 0:
+        raise OSError(f"NVMe admin command {opcode:#04x} failed with status {status:#x}")
+
+# Format NVM with Secure Erase Setting 1 (user data erase), keeping the
+# namespace's current LBA format -- the same command `nvme format --ses=1` sends.
+def nvme_format_ses(device):
+    if fcntl is None:
+        raise OSError("NVMe secure erase needs the Linux NVMe ioctl interface")
+    fd = os.open(device, os.O_RDWR)
+    try:
+        try:
+            nsid = fcntl.ioctl(fd, NVME_IOCTL_ID)
+        except OSError:
+            raise OSError(f"{device} is not an NVMe namespace (expected e.g. /dev/nvme0n1)") from None
+        identify = ctypes.create_string_buffer(4096)
+        nvme_admin_cmd(fd, NVME_ADMIN_IDENTIFY, nsid, cdw10=0, data=identify)
+        flbas = identify.raw[26]
+        lbaf = (flbas & 0x0F) | ((flbas >> 5) & 0x03) << 4
+        cdw10 = (lbaf & 0x0F) | (1 << 9) | ((lbaf >> 4) & 0x03) << 12
+        nvme_admin_cmd(fd, NVME_ADMIN_FORMAT_NVM, nsid, cdw10=cdw10,
+                       timeout_ms=NVME_FORMAT_TIMEOUT_MS)
+    finally:
+        os.close(fd)
+
+def ata_pass_through(fd, command, data=None, timeout_ms=ATA_TIMEOUT_MS):
+    cdb = bytearray(16)
+    cdb[0] = ATA_16
+    if data is None:
+        cdb[1] = ATA_PROTO_NON_DATA << 1
+        direction = SG_DXFER_NONE
+        data_buf = None
+    else:
+        cdb[1] = ATA_PROTO_PIO_DATA_OUT << 1
+        cdb[2] = 0x06  # T_DIR=to device, BYT_BLOK=1, T_LENGTH=sector count
+        cdb[6] = len(data) // 512
+        direction = SG_DXFER_TO_DEV
+        data_buf = ctypes.create_string_buffer(data, len(data))
+    cdb[14] = command
+    cdb_buf = ctypes.create_string_buffer(bytes(cdb), len(cdb))
+    sense = ctypes.create_string_buffer(32)
+    hdr = bytearray(SG_IO_HDR.pack(
+        ord("S"), direction, len(cdb), len(sense), 0,
+        len(data) if data is not None else 0,
+        ctypes.addressof(data_buf) if data_buf is not None else 0,
+        ctypes.addressof(cdb_buf), ctypes.addressof(sense),
+        timeout_ms, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+    fcntl.ioctl(fd, SG_IO, hdr)
+    fields = SG_IO_HDR.unpack(hdr)
+    status, host_status, driver_status = fields[13], fields[17], fields[18]
+    if status or host_status or driver_status:
+        raise OSError(f"ATA command {command:#04x} failed "
+                      f"(status {status:#x}, host {host_status:#x}, driver {driver_status:#x})")
+
+# 512-byte SECURITY command payload: word 0 = control (0: user password,
+# normal erase), words 1-16 = password.
+def ata_security_data(password):
+    return struct.pack("<H32s", 0, password).ljust(512, b"\0")
+
+# Set a temporary user password, then SECURITY ERASE PREPARE + ERASE UNIT,
+# all on one open descriptor -- what `hdparm --security-set-pass` followed by
+# `hdparm --security-erase` does, without two sudo/hdparm round trips.
+def ata_security_erase(device):
+    if fcntl is None:
+        raise OSError("ATA secure erase needs the Linux SG_IO interface")
+    data = ata_security_data(ATA_SECURITY_PASSWORD)
+    fd = os.open(device, os.O_RDWR)
+    try:
+        ata_pass_through(fd, ATA_SECURITY_SET_PASSWORD, data)
+        ata_pass_through(fd, ATA_SECURITY_ERASE_PREPARE)
+        ata_pass_through(fd, ATA_SECURITY_ERASE_UNIT, data, timeout_ms=ATA_ERASE_TIMEOUT_MS)
+    finally:
+        os.close(fd)
+
+def full_disk_erase(device, is_nvme, dry_run, assume_yes=False):
     if dry_run:
         print(f"[DRY-RUN] Would securely erase device: {device}")
+        now = datetime.now(timezone.utc)
         metadata = {
             "operation": "full-disk-erase",
             "device": device,
             "nvme": is_nvme,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": now.isoformat().replace("+00:00", "Z"),
             "status": "dry-run"
         }
-        generate_certificate(metadata, "disk_erase")
+        generate_certificate(metadata, "disk_erase", now)
+        return
+
+    if hasattr(os, "geteuid") and os.geteuid() != 0:
+        print("[!] Secure erase must be run as root. No changes made.")
         return
 
     print(f"\n⚠️ WARNING: You are about to ERASE ALL DATA on device {device}")
     print("This action is IRREVERSIBLE and will wipe the entire SSD.")
-    confirm = input("\nTo confirm, type ERASE-ALL and press Enter: ")
-    if confirm.strip() != "ERASE-ALL":
-        print("[!] Aborted by user. No changes made.")
-        return
+    if not assume_yes:
+        print("\nTo confirm, type ERASE-ALL and press Enter: ", end="", flush=True)
+        confirm = sys.stdin.readline().strip()
+        if not hmac.compare_digest(confirm.encode(), b"ERASE-ALL"):
+            print("[!] Aborted by user. No changes made.")
+            return
 
     try:
         if is_nvme:
             print(f"[*] Running NVMe secure erase on {device}")
-            subprocess.run(["sudo", "nvme", "format", device, "--ses=1"], check=True)
+            nvme_format_ses(device)
         else:
             print(f"[*] Running ATA secure erase on {device}")
-            subprocess.run(["sudo", "hdparm", "--user-master", "u", "--security-set-pass", "p", device], check=True)
-            subprocess.run(["sudo", "hdparm", "--user-master", "u", "--security-erase", "p", device], check=True)
+            ata_security_erase(device)
 
+        now = datetime.now(timezone.utc)
         metadata = {
             "operation": "full-disk-erase",
             "device": device,
             "nvme": is_nvme,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": now.isoformat().replace("+00:00", "Z"),
             "status": "completed"
         }
-        generate_certificate(metadata, "disk_erase")
+        generate_certificate(metadata, "disk_erase", now)
     except Exception as e:
         print(f"[!] Error: {e}")
 
-def file_crypto_shred(file_path, dry_run):
+# AES-CTR keystream counter block for the 16-byte block at byte offset `offset`.
+def ctr_nonce_at(nonce, offset):
+    counter = (int.from_bytes(nonce, "big") + offset // 16) % (1 << 128)
+    return counter.to_bytes(16, "big")
+
+# Unbuffered (raw) files may accept fewer bytes than offered.
+def write_all(f, data):
+    view = memoryview(data)
+    while view:
+        view = view[f.write(view):]
+
+# Encrypt an open file in place with one CTR stream, chunk by chunk. Unlike
+# per-chunk GCM calls this never reuses a nonce and adds no tag, so output
+# length == input length and ciphertext can go straight back over plaintext.
+def shred_stream(f, key, nonce, chunk_size):
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    encryptor = Cipher(algorithms.AES(key), modes.CTR(nonce)).encryptor()
+    # Both buffers and their views are allocated once; the loop only slices.
+    buf = memoryview(bytearray(chunk_size))
+    out = memoryview(bytearray(chunk_size + 15))  # update_into wants len + block_size - 1
+    while True:
+        pos = f.tell()
+        n = f.readinto(buf)
+        if not n:
+            break
+        written = encryptor.update_into(buf[:n], out)
+        f.seek(pos)
+        write_all(f, out[:written])
+    write_all(f, encryptor.finalize())
+
+# Encrypt one mapped region of the file in place: ciphertext overwrites
+# plaintext in the same pages, with no read/write syscalls and no bounce
+# buffer. `start` is the region's file offset; the counter is advanced to its
+# first block, so the result is identical to what shred_stream would produce.
+def shred_region(mm, key, nonce, start, chunk_size):
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    encryptor = Cipher(algorithms.AES(key), modes.CTR(ctr_nonce_at(nonce, start))).encryptor()
+    length = len(mm)
+    if hasattr(mm, "madvise"):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    with memoryview(mm) as view:
+        for off in range(0, length, chunk_size):
+            end = min(off + chunk_size, length)
+            if end + 15 <= length:
+                # update_into wants 15 bytes of slack in its output; borrow
+                # them from the next, still-plaintext chunk -- CTR only
+                # writes end - off bytes.
+                encryptor.update_into(view[off:end], view[off:end + 15])
+            else:
+                view[off:end] = encryptor.update(view[off:end])
+        encryptor.finalize()
+    mm.flush()
+
+# AES-CTR blocks are independent, so split the file into one region per
+# worker (a single region covering the whole file when workers == 1).
+# Regions start on mmap-granularity boundaries, which are also multiples of
+# the AES block size. Returns (start, mmap) pairs; mapping everything before
+# any byte is written lets the caller fall back to shred_stream when the
+# filesystem or address space refuses the mapping.
+def map_regions(fd, file_size, workers):
+    granularity = mmap.ALLOCATIONGRANULARITY
+    region = -(-file_size // workers)
+    region = -(-region // granularity) * granularity
+    maps = []
+    try:
+        for start in range(0, file_size, region):
+            maps.append((start, mmap.mmap(fd, min(region, file_size - start), offset=start)))
+    except BaseException:
+        for _, mm in maps:
+            mm.close()
+        raise
+    return maps
+
+# Shred every mapped region on its own thread. OpenSSL releases the GIL while
+# encrypting, so threads scale until the disk becomes the bottleneck.
+def shred_regions(maps, key, nonce, chunk_size):
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(maps)) as pool:
+            futures = [
+                pool.submit(shred_region, mm, key, nonce, start, chunk_size)
+                for start, mm in maps
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        for _, mm in maps:
+            mm.close()
+
+# Zero key material in place so it does not linger in the heap (and in core
+# dumps or swap) until the buffer is garbage collected.
+def wipe(buf):
+    ctypes.memset((ctypes.c_char * len(buf)).from_buffer(buf), 0, len(buf))
+
+def file_crypto_shred(file_path, dry_run, chunk_size=CHUNK_SIZE):
     if not os.path.exists(file_path):
         print("[!] File does not exist")
         return
 
-    key = AESGCM.generate_key(bit_length=256)
-    aesgcm = AESGCM(key)
-    iv = secrets.token_bytes(12)  # 96-bit nonce for GCM
+    # AES-CTR rather than an AEAD mode: the ciphertext is never decrypted or
+    # verified, the threat model is key destruction, so authenticity buys
+    # nothing here and GHASH would only cost throughput.
+    # One getrandom() call for both: 256-bit one-time key + initial CTR counter
+    # block. os.urandom waits for the kernel CSPRNG to be seeded, which a raw
+    # /dev/urandom read does not on older kernels. The key is then used and
+    # wiped from a mutable buffer; the short-lived bytes object os.urandom
+    # returns is freed without being zeroed.
+    rnd = bytearray(os.urandom(48))
+    key, nonce = memoryview(rnd)[:32], bytes(rnd[32:])
+    # Key fingerprint for audit
+    fingerprint = hashlib.sha256(key).hexdigest()
 
     if dry_run:
+        wipe(rnd)
         print(f"[DRY-RUN] Would crypto-shred file: {file_path}")
+        now = datetime.now(timezone.utc)
         metadata = {
             "operation": "crypto-shred",
             "target": file_path,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "key_fingerprint": key.hex(),
+            "timestamp": now.isoformat().replace("+00:00", "Z"),
+            "key_fingerprint": fingerprint,
             "status": "dry-run"
         }
-        generate_certificate(metadata, "file_shred")
+        generate_certificate(metadata, "file_shred", now)
         return
 
-    temp_path = file_path + ".tmp"
     try:
-        with open(file_path, "rb") as fin, open(temp_path, "wb") as fout:
-            while True:
-                chunk = fin.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                encrypted = aesgcm.encrypt(iv, chunk, None)
-                fout.write(encrypted)
-
-        os.replace(temp_path, file_path)
-
-        # Key fingerprint for audit
-        fingerprint = secrets.token_hex(16)
+        file_size = os.path.getsize(file_path)
+        workers = (os.cpu_count() or 1) if file_size >= PARALLEL_MIN_SIZE else 1
+        # Unbuffered: on the fallback path each chunk is one read(2)/write(2)
+        # straight into our own buffers, without a BufferedRandom copy.
+        with open(file_path, "r+b", buffering=0) as f:
+            fadvise(f, "POSIX_FADV_SEQUENTIAL", "POSIX_FADV_NOREUSE")
+            # mmap cannot map an empty file; Windows keeps the streaming path,
+            # as do filesystems that refuse shared writable mappings (e.g. FUSE
+            # direct_io) and files too large for the address space. A file
+            # truncated by someone else mid-shred is not handled: touching the
+            # mapping past the new end raises SIGBUS.
+            maps = None
+            if file_size > 0 and platform.system() != "Windows":
+                try:
+                    maps = map_regions(f.fileno(), file_size, workers)
+                except (OSError, ValueError, OverflowError):
+                    maps = None
+            if maps:
+                shred_regions(maps, key, nonce, chunk_size)
+            else:
+                stream_chunk_size = effective_chunk_size(chunk_size)
+                if stream_chunk_size < chunk_size:
+                    print(f"[*] Chunk size reduced to {stream_chunk_size // 1024} KiB "
+                          "to fit in free memory")
+                shred_stream(f, key, nonce, stream_chunk_size)
+            # Dirty pages can only be dropped once they are on disk.
+            f.flush()
+            os.fsync(f.fileno())
+            fadvise(f, "POSIX_FADV_DONTNEED")
 
+        now = datetime.now(timezone.utc)
         metadata = {
             "operation": "crypto-shred",
             "target": file_path,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": now.isoformat().replace("+00:00", "Z"),
             "key_fingerprint": fingerprint,
             "status": "completed"
         }
-        generate_certificate(metadata, "file_shred")
+        generate_certificate(metadata, "file_shred", now)
         print(f"[+] File crypto-shredded: {file_path}")
     except Exception as e:
         print(f"[!] Error during file shred: {e}")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+    finally:
+        wipe(rnd)
 
 def interactive_mode():
     print("=== SecureWipe Interactive Mode ===")
@@ -155,14 +460,19 @@ def main():
     parser.add_argument("--file", help="Target file for crypto-shred")
     parser.add_argument("--dry-run", action="store_true", help="Simulate actions without making changes")
     parser.add_argument("--interactive", action="store_true", help="Run interactive mode")
+    parser.add_argument("--yes", action="store_true", help="Skip the ERASE-ALL confirmation prompt (scripted use)")
+    parser.add_argument("--chunk-size-mb", type=int, default=CHUNK_SIZE // (1024 * 1024),
+                        help="Chunk size in MiB for file crypto-shred (default: %(default)s)")
     args = parser.parse_args()
+    if args.chunk_size_mb <= 0:
+        parser.error("--chunk-size-mb must be a positive integer")
 
     if args.interactive:
         interactive_mode()
     elif args.device:
-        full_disk_erase(args.device, args.nvme, args.dry_run)
+        full_disk_erase(args.device, args.nvme, args.dry_run, args.yes)
     elif args.cryptoshred and args.file:
-        file_crypto_shred(args.file, args.dry_run)
+        file_crypto_shred(args.file, args.dry_run, args.chunk_size_mb * 1024 * 1024)
     else:
         print("[!] No valid operation specified. Use --help for options.")
 